@@ -5,6 +5,7 @@ Extracted from notebooks/CRAG.ipynb and integrated with existing chatbot structu
 
 import chainlit as cl
 import os
+import threading
 from dotenv import load_dotenv
 
 from langchain_openai import ChatOpenAI
@@ -20,6 +21,7 @@ from pathlib import Path
 # Add parent directory to path to import crag module
 sys.path.append(str(Path(__file__).parent.parent))
 from rag.retrieve_db import ensemble_retriever
+from rag.semantic_cache import SemanticCache, index_version, stream_answer
 
 # Load environment variables
 load_dotenv()
@@ -49,15 +51,35 @@ class Chat:
     Chat class for handling conversations with RAG retrieval.
     """
 
-    def __init__(self, collection: str = 'design') -> None:
+    def __init__(self, collection: str = 'design', semantic_cache: bool = False, batch_rerank: bool = False) -> None:
         """
         Initialize the chat with retriever and memory.
         
         Args:
             collection: str, name of the collection to use
+            semantic_cache: bool, reuse answers of near-duplicate questions
+            batch_rerank: bool, rerank through the cross-request micro-batching service
         """
-        self.retriever = ensemble_retriever(collection)
+        self.collection = collection
+        self.batch_rerank = batch_rerank
+        self._retriever = None
+        self._retriever_lock = threading.Lock()
         self.memory = ConversationBufferWindowMemory(k=4, return_messages=True)
+
+        self.cache = SemanticCache() if semantic_cache else None
+
+    @property
+    def retriever(self):
+        """
+        Retriever of the collection, built on first use so the app starts fast.
+        
+        Returns:
+            ContextualCompressionRetriever, ChromaDB+BM25+ReRanker
+        """
+        with self._retriever_lock:
+            if self._retriever is None:
+                self._retriever = ensemble_retriever(self.collection, batch_rerank=self.batch_rerank)
+        return self._retriever
     
     def get_context(self, prompt: str) -> list:
         """
@@ -72,13 +94,27 @@ class Chat:
         context = self.retriever.invoke(prompt)
         return context
     
-    def chain_to_response(self) -> object:
+    def new_memory(self) -> ConversationBufferWindowMemory:
+        """
+        Create the memory of a conversation, each Chainlit session has its own.
+        
+        Returns:
+            ConversationBufferWindowMemory, last 4 turns of the conversation
+        """
+        return ConversationBufferWindowMemory(k=4, return_messages=True)
+    
+    def chain_to_response(self, memory: ConversationBufferWindowMemory = None) -> object:
         """
         Create the chain for generating responses.
         
+        Args:
+            memory: ConversationBufferWindowMemory, conversation memory (self.memory if None)
+        
         Returns:
             LangChain chain object
         """
+        memory = memory if memory is not None else self.memory
+
         output_model = ChatOpenAI(
             model='gpt-4o',
             streaming=True,
@@ -94,7 +130,7 @@ class Chat:
 
         chain = (
             RunnablePassthrough.assign(
-                history=RunnableLambda(self.memory.load_memory_variables) | itemgetter('history')
+                history=RunnableLambda(memory.load_memory_variables) | itemgetter('history')
             )
             | final_prompt
             | output_model
@@ -103,18 +139,41 @@ class Chat:
 
         return chain
     
-    def main(self, prompt: str):
+    def main(self, prompt: str, memory: ConversationBufferWindowMemory = None):
         """
         Main method to process a prompt and generate a streaming response.
         
+        Only standalone questions (empty history) use the semantic cache, follow-up
+        questions depend on the conversation and always go to the LLM.
+        
         Args:
             prompt: str, user's question
+            memory: ConversationBufferWindowMemory, conversation memory (self.memory if None)
         
         Yields:
             str, chunks of the response
         """
+        memory = memory if memory is not None else self.memory
+        use_cache = self.cache is not None and not memory.load_memory_variables({})['history']
+
+        if use_cache:
+            # Checked on every call, so rebuilding the index invalidates the stored answers
+            version = index_version(self.collection)
+            embedding = self.cache.embed(prompt)
+            answer = self.cache.get(embedding, self.collection, version)
+
+            if answer is not None:
+                for chunk in stream_answer(answer):
+                    yield chunk
+
+                memory.save_context(
+                    {'question': prompt},
+                    {'response': answer}
+                )
+                return
+
         context = self.get_context(prompt)
-        chain = self.chain_to_response()
+        chain = self.chain_to_response(memory)
 
         response = ''
         for chunk in chain.stream({
@@ -123,15 +182,21 @@ class Chat:
         }):
             yield chunk
             response += chunk
-            
-            self.memory.save_context(
-                {'question': prompt},
-                {'response': response}
-            )
+
+        memory.save_context(
+            {'question': prompt},
+            {'response': response}
+        )
+
+        if use_cache and response:
+            self.cache.put(embedding, response, self.collection, version)
 
 
 # Initialize chatbot
-chatbot = Chat()
+chatbot = Chat(
+    semantic_cache=os.getenv('SEMANTIC_CACHE', 'false').lower() == 'true',
+    batch_rerank=os.getenv('BATCH_RERANK', 'false').lower() == 'true'
+)
 
 
 @cl.on_message
@@ -146,7 +211,16 @@ async def on_message(message: cl.Message):
     response = ''
 
     async with cl.Step(type='run'):
-        for chunk in chatbot.main(prompt=message.content):
+        # Run each step of the generator (retrieval and LLM) in a thread, off the
+        # event loop, so concurrent requests reach the reranker together
+        chunks = chatbot.main(prompt=message.content, memory=cl.user_session.get('memory'))
+        next_chunk = cl.make_async(next)
+
+        while True:
+            chunk = await next_chunk(chunks, None)
+            if chunk is None:
+                break
+
             await msg.stream_token(chunk)
             response += chunk
 
@@ -158,6 +232,9 @@ async def on_chat_start():
     """
     Initialize the chat session.
     """
+    # Each session has its own memory, the retriever and the cache are shared
+    cl.user_session.set('memory', chatbot.new_memory())
+
     await cl.Message(
         content="¡Hola! Soy un asistente especializado en responder preguntas sobre documentos PDF. ¿En qué puedo ayudarte?"
     ).send()
@@ -4,6 +4,9 @@ from langchain.schema import StrOutputParser
 from langchain.schema.runnable import RunnableLambda, RunnablePassthrough
 from langchain.memory import ConversationBufferWindowMemory
 import os
+import sys
+import threading
+from pathlib import Path
 from operator import itemgetter
 from dotenv import load_dotenv
 load_dotenv(override=True)
@@ -11,25 +14,50 @@ load_dotenv(override=True)
 from tools import ensemble_retriever, logger
 from .prompt import system_prompt, question_prompt
 
+# añade la raiz del repo para importar el modulo rag
+sys.path.append(str(Path(__file__).parent.parent.parent))
+from rag.semantic_cache import SemanticCache, index_version, stream_answer
+
 # api key
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
 
 class Chat:
 
-    def __init__(self, collection: str='design') -> None:
+    def __init__(self, collection: str='design', semantic_cache: bool=False, batch_rerank: bool=False) -> None:
         logger.info('Init chat...')
-        self.retriever = ensemble_retriever(collection)
+        self.collection = collection
+        self.batch_rerank = batch_rerank
+        self._retriever = None
+        self._retriever_lock = threading.Lock()
         self.memory = ConversationBufferWindowMemory(k=4, return_messages=True)
 
+        self.cache = SemanticCache() if semantic_cache else None
+
+
+    @property
+    def retriever(self):
+        # se construye en el primer uso para que el front arranque rapido
+        with self._retriever_lock:
+            if self._retriever is None:
+                self._retriever = ensemble_retriever(self.collection, batch_rerank=self.batch_rerank)
+        return self._retriever
+
     
     def get_context(self, prompt: str) -> list:
         logger.info('Getting context...')
         context = self.retriever.invoke(prompt)
         return context
     
+
+    def new_memory(self) -> ConversationBufferWindowMemory:
+        # memoria de una conversacion, cada sesion de chainlit tiene la suya
+        return ConversationBufferWindowMemory(k=4, return_messages=True)
+
     
-    def chain_to_response(self) -> object:
+    def chain_to_response(self, memory: ConversationBufferWindowMemory=None) -> object:
+
+        memory = memory if memory is not None else self.memory
 
         output_model = ChatOpenAI(model='gpt-4.1', streaming=True, max_retries=1, max_tokens=32768)
 
@@ -40,17 +68,37 @@ class Chat:
                                                          ('human', question_prompt)])
 
 
-        chain = (RunnablePassthrough.assign(history=RunnableLambda(self.memory.load_memory_variables) 
+        chain = (RunnablePassthrough.assign(history=RunnableLambda(memory.load_memory_variables) 
                                             | itemgetter('history'))) | final_prompt  | output_model | StrOutputParser()
 
         return chain
     
     
-    def main(self, prompt: str):
+    def main(self, prompt: str, memory: ConversationBufferWindowMemory=None):
+
+        memory = memory if memory is not None else self.memory
+
+        # solo las preguntas sin historial usan la cache, las de seguimiento dependen de la conversacion
+        use_cache = self.cache is not None and not memory.load_memory_variables({})['history']
+
+        if use_cache:
+            # se calcula en cada llamada, si se reconstruye el indice no se sirven respuestas viejas
+            version = index_version(self.collection, data_dir='../data')
+            embedding = self.cache.embed(prompt)
+            answer = self.cache.get(embedding, self.collection, version)
+
+            if answer is not None:
+                logger.info('Answer from semantic cache...')
+                for chunk in stream_answer(answer):
+                    yield(chunk)
+
+                memory.save_context({'question': prompt}, 
+                                    {'response': answer})
+                return
 
         context = self.get_context(prompt)
 
-        chain = self.chain_to_response()
+        chain = self.chain_to_response(memory)
 
         response = ''
         logger.info('Generating response...')
@@ -60,9 +108,12 @@ class Chat:
                 yield(chunk)
 
                 response += chunk
-                
-                self.memory.save_context({'question': prompt}, 
-                                         {'response': response})
+
+        memory.save_context({'question': prompt}, 
+                            {'response': response})
+
+        if use_cache and response:
+            self.cache.put(embedding, response, self.collection, version)
 
 
 
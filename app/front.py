@@ -1,9 +1,18 @@
 import chainlit as cl
+import os
 from tools import logger
 from chatbot import Chat
 
 
-chatbot = Chat()
+chatbot = Chat(semantic_cache=os.getenv('SEMANTIC_CACHE', 'false').lower() == 'true',
+               batch_rerank=os.getenv('BATCH_RERANK', 'false').lower() == 'true')
+
+@cl.on_chat_start
+async def on_chat_start():
+
+    # cada sesion tiene su propia memoria, el retriever y la cache se comparten
+    cl.user_session.set('memory', chatbot.new_memory())
+
 
 @cl.on_message
 async def on_message(message: cl.Message):
@@ -13,8 +22,17 @@ async def on_message(message: cl.Message):
     response = ''
 
     async with cl.Step(type='run'):
+
+        # cada paso del generador (retrieval y LLM) corre en un hilo, fuera del event loop,
+        # para que las peticiones concurrentes lleguen juntas al reranker
+        chunks = chatbot.main(prompt=message.content, memory=cl.user_session.get('memory'))
+        next_chunk = cl.make_async(next)
     
-        for chunk in chatbot.main(prompt=message.content):
+        while True:
+            chunk = await next_chunk(chunks, None)
+            if chunk is None:
+                break
+
             await msg.stream_token(chunk)
 
             response += chunk
@@ -1,22 +1,30 @@
-from langchain.retrievers import ContextualCompressionRetriever, EnsembleRetriever
-from langchain_openai import OpenAIEmbeddings
-from langchain_chroma import Chroma
-from langchain_community.document_transformers.embeddings_redundant_filter import EmbeddingsRedundantFilter
-from langchain.retrievers.document_compressors import FlashrankRerank, DocumentCompressorPipeline
+from __future__ import annotations
+from typing import TYPE_CHECKING
 import pickle
 
+if TYPE_CHECKING:
+    from langchain.retrievers import ContextualCompressionRetriever
 
-def ensemble_retriever(collection_name: str) -> ContextualCompressionRetriever:
+
+def ensemble_retriever(collection_name: str, batch_rerank: bool=False) -> ContextualCompressionRetriever:
     
     """
     Recuperación desde ChromaDB y BM25.
     
     Params:
     collection_name: str, coleccion a ser usada 
+    batch_rerank: bool, reranking con el servicio de micro-batching entre peticiones (rag.rerank_service)
 
     Return:
     ContextualCompressionRetriever, ChromaDB+BM25+ReRanker 
     """
+
+    # imports en el primer uso, langchain y flashrank tardan en cargar
+    from langchain.retrievers import ContextualCompressionRetriever, EnsembleRetriever
+    from langchain_openai import OpenAIEmbeddings
+    from langchain_chroma import Chroma
+    from langchain_community.document_transformers.embeddings_redundant_filter import EmbeddingsRedundantFilter
+    from langchain.retrievers.document_compressors import FlashrankRerank, DocumentCompressorPipeline
     
     embeddings = OpenAIEmbeddings()
     
@@ -41,7 +49,12 @@ def ensemble_retriever(collection_name: str) -> ContextualCompressionRetriever:
 
     redundant_filter = EmbeddingsRedundantFilter(embeddings=embeddings)
 
-    reranker = FlashrankRerank()
+    if batch_rerank:
+        from rag.rerank_service import BatchedFlashrankRerank, get_rerank_batcher
+        batcher = get_rerank_batcher()
+        reranker = BatchedFlashrankRerank(client=batcher.ranker, batcher=batcher)
+    else:
+        reranker = FlashrankRerank()
 
     pipeline_compressor = DocumentCompressorPipeline(transformers=[redundant_filter, reranker])
 
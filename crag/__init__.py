@@ -2,8 +2,21 @@
 RAG module for vector database creation and retrieval.
 """
 
-from .create_vectordb import VectorDB
-from .retrieve_db import ensemble_retriever
+from importlib import import_module
+
+# Lazy re-exports, langchain is only loaded when a name is first used
+_EXPORTS = {
+    'VectorDB': 'rag.create_vectordb',
+    'ensemble_retriever': 'rag.retrieve_db',
+}
 
 __all__ = ['VectorDB', 'ensemble_retriever']
 
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(import_module(_EXPORTS[name]), name)
+    globals()[name] = value
+    return value
@@ -3,8 +3,14 @@ Deprecated module. Please use `rag.create_vectordb` instead.
 This file remains for backward compatibility and re-exports VectorDB.
 """
 
-from rag.create_vectordb import VectorDB  # re-export
+
+def __getattr__(name: str):
+    # Lazy re-export, so importing the shim does not load langchain
+    if name == 'VectorDB':
+        from rag.create_vectordb import VectorDB
+        return VectorDB
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 if __name__ == '__main__':
     print("[DEPRECATED] Use `python rag/create_vectordb.py` instead.")
-
@@ -3,8 +3,14 @@ Deprecated module. Please use `rag.retrieve_db` instead.
 This file remains for backward compatibility and re-exports ensemble_retriever.
 """
 
-from rag.retrieve_db import ensemble_retriever  # re-export
+
+def __getattr__(name: str):
+    # Lazy re-export, so importing the shim does not load langchain
+    if name == 'ensemble_retriever':
+        from rag.retrieve_db import ensemble_retriever
+        return ensemble_retriever
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 if __name__ == '__main__':
     print("[DEPRECATED] Use `python rag/retrieve_db.py` instead.")
-
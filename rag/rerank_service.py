@@ -0,0 +1,416 @@
+"""
+Cross-request micro-batching service for the FlashRank reranker.
+
+Each call to `FlashrankRerank` runs its own small ONNX inference. Under
+concurrent load those tiny calls compete for the CPU cores, so this module
+collects (query, candidates) pairs from concurrent requests during a short
+time window and scores them all in a single inference on a dedicated worker.
+"""
+
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import argparse
+import queue
+import threading
+import time
+
+import numpy as np
+from flashrank import Ranker, RerankRequest
+from langchain.schema import Document
+from langchain.retrievers.document_compressors import FlashrankRerank
+
+
+# Same default model as langchain's FlashrankRerank
+DEFAULT_MODEL = 'ms-marco-MultiBERT-L-12'
+
+
+def rerank_batch(ranker: Ranker,
+                 requests: Sequence[Tuple[str, List[Dict[str, Any]]]],
+                 max_pairs: int = 256) -> List[List[Dict[str, Any]]]:
+    """
+    Score the (query, passage) pairs of many requests in shared ONNX inferences.
+
+    Args:
+        ranker: Ranker, FlashRank model to use
+        requests: list of (query, passages) tuples, passages as expected by FlashRank
+        max_pairs: int, maximum number of pairs per inference, bounds memory usage
+
+    Returns:
+        list with the passages of each request and their `score`, sorted by relevance
+    """
+    session = getattr(ranker, 'session', None)
+    tokenizer = getattr(ranker, 'tokenizer', None)
+
+    # Listwise (LLM) models can not share an inference between queries
+    if session is None or tokenizer is None:
+        return [ranker.rerank(RerankRequest(query=query, passages=passages)) for query, passages in requests]
+
+    pairs = [[query, passage['text']] for query, passages in requests for passage in passages]
+
+    scores = []
+    for start in range(0, len(pairs), max_pairs):
+        encoded = tokenizer.encode_batch(pairs[start:start + max_pairs])
+
+        input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+        token_type_ids = np.array([e.type_ids for e in encoded], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+
+        onnx_input = {'input_ids': input_ids, 'attention_mask': attention_mask}
+        if not np.all(token_type_ids == 0):
+            onnx_input['token_type_ids'] = token_type_ids
+
+        logits = session.run(None, onnx_input)[0]
+
+        if logits.shape[1] == 1:
+            scores.append(1 / (1 + np.exp(-logits.flatten())))
+        else:
+            exp_logits = np.exp(logits)
+            scores.append(exp_logits[:, 1] / np.sum(exp_logits, axis=1))
+
+    scores = np.concatenate(scores) if scores else np.empty(0)
+
+    results = []
+    offset = 0
+    for _, passages in requests:
+        for passage, score in zip(passages, scores[offset:offset + len(passages)]):
+            passage['score'] = score
+        offset += len(passages)
+
+        results.append(sorted(passages, key=lambda x: x['score'], reverse=True))
+
+    return results
+
+
+def ranked_documents(passages: List[Dict[str, Any]],
+                     top_n: int,
+                     score_threshold: Optional[float] = None,
+                     prefix_metadata: str = '') -> List[Document]:
+    """
+    Convert reranked FlashRank passages back to documents, as FlashrankRerank does.
+
+    Args:
+        passages: list of passages sorted by relevance
+        top_n: int, number of passages to keep
+        score_threshold: float, minimum score to keep a passage (None to keep all)
+        prefix_metadata: str, prefix for the `id` and `relevance_score` metadata keys
+
+    Returns:
+        list of documents with their relevance score
+    """
+    documents = []
+    for r in passages[:top_n]:
+        if score_threshold is None or r['score'] >= score_threshold:
+            metadata = {
+                f'{prefix_metadata}id': r['id'],
+                f'{prefix_metadata}relevance_score': r['score'],
+                **r['meta']
+            }
+            documents.append(Document(page_content=r['text'], metadata=metadata))
+
+    return documents
+
+
+class _PendingRerank:
+    """
+    A single (query, passages) pair waiting in the batcher queue.
+    """
+
+    __slots__ = ('query', 'passages', 'deadline', 'future')
+
+    def __init__(self, query: str, passages: List[Dict[str, Any]], deadline: float):
+        self.query = query
+        self.passages = passages
+        self.deadline = deadline
+        self.future = Future()
+
+
+class RerankBatcher:
+    """
+    Dedicated worker that reranks requests from many threads in shared batches.
+    """
+
+    def __init__(self,
+                 ranker: Optional[Ranker] = None,
+                 max_batch_size: int = 16,
+                 max_wait_ms: float = 5.0,
+                 max_queue_size: int = 256,
+                 slo_ms: float = 1000.0):
+        """
+        Initialize the batcher and start its worker thread.
+
+        Args:
+            ranker: Ranker, FlashRank model to use (DEFAULT_MODEL if None)
+            max_batch_size: int, maximum number of requests scored together
+            max_wait_ms: float, time window to collect requests for a batch
+            max_queue_size: int, bound of the pending requests queue
+            slo_ms: float, soft latency objective of a request, queue wait included. Requests
+                    not started by the worker before it are scored on the caller thread
+        """
+        self.ranker = ranker if ranker is not None else Ranker(model_name=DEFAULT_MODEL)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.slo = slo_ms / 1000
+        self.fallbacks = 0
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._fallbacks_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._stop_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name='rerank-batcher', daemon=True)
+        self._worker.start()
+
+    def rerank(self, query: str, passages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Rerank the passages for a query, sharing the inference with other requests.
+
+        Args:
+            query: str, user's question
+            passages: list of dicts with `id`, `text` and `meta`, as expected by FlashRank
+
+        Returns:
+            list of passages with their `score`, sorted by relevance
+        """
+        if not passages:
+            return []
+
+        pending = _PendingRerank(query, passages, time.monotonic() + self.slo)
+
+        # Checked under the lock so no request is queued after `stop` drained the queue
+        with self._stop_lock:
+            if self._stopped.is_set():
+                raise RuntimeError('RerankBatcher is stopped.')
+
+            try:
+                self._queue.put_nowait(pending)
+            except queue.Full:
+                pending = None
+
+        if pending is None:
+            # Queue is saturated, score on the caller thread instead of piling up
+            return self._fallback(query, passages)
+
+        try:
+            return pending.future.result(timeout=self.slo)
+        except FutureTimeoutError:
+            # Soft SLO: if the worker has not started the request yet, score it here
+            if pending.future.cancel():
+                return self._fallback(query, passages)
+            return pending.future.result()
+
+    def _fallback(self, query: str, passages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Score a request on the caller thread, without batching.
+
+        Args:
+            query: str, user's question
+            passages: list of passages, as expected by FlashRank
+
+        Returns:
+            list of passages with their `score`, sorted by relevance
+        """
+        with self._fallbacks_lock:
+            self.fallbacks += 1
+
+        return self.ranker.rerank(RerankRequest(query=query, passages=passages))
+
+    def stop(self) -> None:
+        """
+        Stop the worker thread, failing any request still in the queue.
+
+        Returns:
+            None
+        """
+        with self._stop_lock:
+            self._stopped.set()
+        self._worker.join()
+
+        while True:
+            try:
+                pending = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if pending.future.set_running_or_notify_cancel():
+                pending.future.set_exception(RuntimeError('RerankBatcher is stopped.'))
+
+    def _run(self) -> None:
+        """
+        Worker loop: collect a batch within the time window and score it.
+
+        Returns:
+            None
+        """
+        while not self._stopped.is_set():
+            try:
+                first = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            # Never hold the oldest request past its SLO waiting for more requests
+            window_end = min(time.monotonic() + self.max_wait, first.deadline)
+
+            while len(batch) < self.max_batch_size:
+                remaining = window_end - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # Skip requests already scored on the caller thread after their SLO
+            live = [pending for pending in batch if pending.future.set_running_or_notify_cancel()]
+
+            if not live:
+                continue
+
+            try:
+                results = self._score_batch(live)
+            except Exception as error:
+                for pending in live:
+                    pending.future.set_exception(error)
+                continue
+
+            for pending, result in zip(live, results):
+                pending.future.set_result(result)
+
+    def _score_batch(self, batch: Sequence[_PendingRerank]) -> List[List[Dict[str, Any]]]:
+        """
+        Score all the (query, passage) pairs of a batch in a single ONNX inference.
+
+        Args:
+            batch: list of pending requests
+
+        Returns:
+            list with the sorted passages of each request
+        """
+        return rerank_batch(self.ranker, [(pending.query, pending.passages) for pending in batch])
+
+
+class BatchedFlashrankRerank(FlashrankRerank):
+    """
+    FlashrankRerank compressor that scores through a shared RerankBatcher.
+    """
+
+    batcher: Any = None
+
+    def compress_documents(self, documents: Sequence[Document], query: str, callbacks=None) -> Sequence[Document]:
+        """
+        Rerank the documents for the query and keep the `top_n` most relevant.
+
+        Args:
+            documents: list of candidate documents
+            query: str, user's question
+            callbacks: callbacks of the retriever run (unused)
+
+        Returns:
+            list of reranked documents with their relevance score
+        """
+        passages = [{'id': i, 'text': doc.page_content, 'meta': doc.metadata} for i, doc in enumerate(documents)]
+
+        response = self.batcher.rerank(query, passages)
+
+        return ranked_documents(response, self.top_n, self.score_threshold, self.prefix_metadata)
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_rerank_batcher() -> RerankBatcher:
+    """
+    Get the process-wide RerankBatcher, creating it on first use.
+
+    Returns:
+        RerankBatcher, shared by every retriever of the process
+    """
+    global _batcher
+
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = RerankBatcher()
+
+    return _batcher
+
+
+def _load_test(rerank, clients: int, requests: int, candidates: int) -> Dict[str, float]:
+    """
+    Run concurrent rerank calls and measure throughput and latency.
+
+    Args:
+        rerank: callable, receives (query, passages) and returns the ranked passages
+        clients: int, number of concurrent threads
+        requests: int, number of requests per thread
+        candidates: int, number of passages per request
+
+    Returns:
+        dict with throughput (requests/s), p50/p95 latency (ms) and failed requests
+    """
+    text = ('Un sistema es un conjunto de elementos interconectados de forma coherente '
+            'y organizados para conseguir algo. ')
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+
+    def client(client_id: int) -> None:
+        for i in range(requests):
+            query = f'¿qué es un sistema complejo? {client_id} {i}'
+            passages = [{'id': j, 'text': f'{j} {text * 3}', 'meta': {}} for j in range(candidates)]
+
+            start = time.perf_counter()
+            try:
+                rerank(query, passages)
+            except Exception as error:
+                with lock:
+                    failures.append(error)
+                continue
+            elapsed = time.perf_counter() - start
+
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(clients)]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total = time.perf_counter() - start
+
+    return {
+        'throughput': len(latencies) / total,
+        'p50_ms': float(np.percentile(latencies, 50)) * 1000 if latencies else float('nan'),
+        'p95_ms': float(np.percentile(latencies, 95)) * 1000 if latencies else float('nan'),
+        'failed': len(failures),
+    }
+
+
+if __name__ == '__main__':
+    # Load test: per-request inference vs cross-request micro-batching
+    parser = argparse.ArgumentParser(description='Load test of the FlashRank micro-batching reranker.')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=20, help='requests per client')
+    parser.add_argument('--candidates', type=int, default=20, help='passages per request')
+    parser.add_argument('--max-batch-size', type=int, default=16, help='requests per batch')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0, help='batching window')
+    parser.add_argument('--slo-ms', type=float, default=1000.0, help='soft latency objective per request')
+    args = parser.parse_args()
+
+    ranker = Ranker(model_name=DEFAULT_MODEL)
+
+    def unbatched(query, passages):
+        return ranker.rerank(RerankRequest(query=query, passages=passages))
+
+    batcher = RerankBatcher(ranker, max_batch_size=args.max_batch_size,
+                            max_wait_ms=args.max_wait_ms, slo_ms=args.slo_ms)
+
+    for name, rerank in [('without batching', unbatched), ('with batching', batcher.rerank)]:
+        stats = _load_test(rerank, args.clients, args.requests, args.candidates)
+        print(f"{name}: {stats['throughput']:.1f} req/s, "
+              f"p50 {stats['p50_ms']:.1f} ms, p95 {stats['p95_ms']:.1f} ms, "
+              f"{stats['failed']} failed")
+
+    print(f"with batching: {batcher.fallbacks} requests scored on the caller thread after their SLO")
+
+    batcher.stop()
@@ -3,25 +3,69 @@ Script for retrieving documents from vector database.
 Extracted from notebooks/CRAG.ipynb
 """
 
-from langchain.retrievers import ContextualCompressionRetriever, BM25Retriever, EnsembleRetriever
-from langchain_openai import OpenAIEmbeddings
-from langchain_chroma import Chroma
-from langchain_community.document_transformers.embeddings_redundant_filter import EmbeddingsRedundantFilter
-from langchain.retrievers.document_compressors import FlashrankRerank, DocumentCompressorPipeline
+from __future__ import annotations
+
+from collections import defaultdict
+from itertools import islice, tee
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List
+import numpy as np
+import argparse
+import json
 import pickle
 import os
 
+import sys
+from pathlib import Path
+
+# Add parent directory to path so the script also runs as `python rag/retrieve_db.py`
+sys.path.append(str(Path(__file__).parent.parent))
+
+# langchain, chromadb and flashrank are imported inside the functions that use them,
+# so importing this module (or running it with --help) stays fast
+if TYPE_CHECKING:
+    from langchain.retrievers import ContextualCompressionRetriever, BM25Retriever
+    from langchain.schema import Document
+
+
+def _load_bm25(collection_name: str) -> BM25Retriever:
+    """
+    Load the pickled BM25 retriever of a collection.
+
+    Args:
+        collection_name: str, collection to be used
+
+    Returns:
+        BM25Retriever, retriever saved by create_vectordb.py
+    """
+    bm25_path = f'data/{collection_name}_bm25'
+    if not os.path.exists(bm25_path):
+        raise FileNotFoundError(f"BM25 retriever not found at {bm25_path}. Please run create_vectordb.py first.")
+
+    with open(bm25_path, 'rb') as bm25_file:
+        bm25_retriever = pickle.load(bm25_file)
+
+    bm25_retriever.k = 10
 
-def ensemble_retriever(collection_name: str) -> ContextualCompressionRetriever:
+    return bm25_retriever
+
+
+def ensemble_retriever(collection_name: str, batch_rerank: bool = False) -> ContextualCompressionRetriever:
     """
     Retrieval from ChromaDB and BM25 with compression and reranking.
     
     Args:
         collection_name: str, collection to be used
+        batch_rerank: bool, rerank through the process-wide micro-batching service
     
     Returns:
         ContextualCompressionRetriever, ChromaDB+BM25+ReRanker
     """
+    from langchain.retrievers import ContextualCompressionRetriever, EnsembleRetriever
+    from langchain_openai import OpenAIEmbeddings
+    from langchain_chroma import Chroma
+    from langchain_community.document_transformers.embeddings_redundant_filter import EmbeddingsRedundantFilter
+    from langchain.retrievers.document_compressors import FlashrankRerank, DocumentCompressorPipeline
+
     embeddings = OpenAIEmbeddings()
     
     # Load ChromaDB
@@ -37,14 +81,7 @@ def ensemble_retriever(collection_name: str) -> ContextualCompressionRetriever:
     )
     
     # Load BM25
-    bm25_path = f'data/{collection_name}_bm25'
-    if not os.path.exists(bm25_path):
-        raise FileNotFoundError(f"BM25 retriever not found at {bm25_path}. Please run create_vectordb.py first.")
-    
-    with open(bm25_path, 'rb') as bm25_file:
-        bm25_retriever = pickle.load(bm25_file)
-    
-    bm25_retriever.k = 10
+    bm25_retriever = _load_bm25(collection_name)
     
     # Create ensemble retriever
     ensemble = EnsembleRetriever(
@@ -54,7 +91,13 @@ def ensemble_retriever(collection_name: str) -> ContextualCompressionRetriever:
     
     # Create compression pipeline
     redundant_filter = EmbeddingsRedundantFilter(embeddings=embeddings)
-    reranker = FlashrankRerank()
+    if batch_rerank:
+        from rag.rerank_service import BatchedFlashrankRerank, get_rerank_batcher
+
+        batcher = get_rerank_batcher()
+        reranker = BatchedFlashrankRerank(client=batcher.ranker, batcher=batcher)
+    else:
+        reranker = FlashrankRerank()
     
     pipeline_compressor = DocumentCompressorPipeline(
         transformers=[redundant_filter, reranker]
@@ -68,17 +111,364 @@ def ensemble_retriever(collection_name: str) -> ContextualCompressionRetriever:
     return compression_pipeline
 
 
+class BatchRetriever:
+    """
+    Batch version of `ensemble_retriever` for bulk retrieval and offline QA runs.
+
+    Queries are embedded in a single call per batch, ChromaDB (MMR) is scored as
+    matrix operations over the whole batch, BM25 from an inverted index of term
+    weights and the reranker scores the candidates of every query in shared inferences.
+    """
+
+    def __init__(self,
+                 collection_name: str,
+                 k: int = 20,
+                 fetch_k: int = 20,
+                 lambda_mult: float = 0.5,
+                 top_n: int = 3,
+                 redundant_threshold: float = 0.95):
+        """
+        Load the collection embeddings, BM25 index and reranker in memory.
+
+        Args:
+            collection_name: str, collection to be used
+            k: int, documents returned by the MMR search
+            fetch_k: int, candidates considered by the MMR search
+            lambda_mult: float, MMR diversity (0 max diversity, 1 min diversity)
+            top_n: int, documents kept by the reranker
+            redundant_threshold: float, similarity above which a document is redundant
+        """
+        from flashrank import Ranker
+        from langchain.retrievers import EnsembleRetriever
+        from langchain.schema import Document
+        from langchain_openai import OpenAIEmbeddings
+        from langchain_chroma import Chroma
+        from rag.rerank_service import DEFAULT_MODEL
+
+        self.k = k
+        self.fetch_k = fetch_k
+        self.lambda_mult = lambda_mult
+        self.top_n = top_n
+        self.redundant_threshold = redundant_threshold
+
+        self.embeddings = OpenAIEmbeddings()
+
+        # Load ChromaDB embeddings as a normalized matrix
+        vectordb = Chroma(
+            persist_directory='data/chroma_db',
+            collection_name=collection_name,
+            embedding_function=self.embeddings
+        )
+        data = vectordb.get(include=['embeddings', 'documents', 'metadatas'])
+
+        self.documents = [
+            Document(page_content=text, metadata=metadata or {})
+            for text, metadata in zip(data['documents'], data['metadatas'])
+        ]
+        self.matrix = self._normalize(np.asarray(data['embeddings'], dtype=np.float32))
+        self.index_by_content = {doc.page_content: i for i, doc in enumerate(self.documents)}
+
+        # Load BM25 as an inverted index of term weights
+        self.bm25 = _load_bm25(collection_name)
+        self.postings = self._bm25_postings(self.bm25.vectorizer)
+
+        # Only used for its reciprocal rank fusion
+        self.ensemble = EnsembleRetriever(
+            retrievers=[vectordb.as_retriever(), self.bm25],
+            weights=[0.5, 0.5]
+        )
+
+        self.ranker = Ranker(model_name=DEFAULT_MODEL)
+
+    def invoke_batch(self, queries: List[str]) -> List[List[Document]]:
+        """
+        Retrieve the reranked documents of every query in the batch.
+
+        Args:
+            queries: list of strings, user's questions
+
+        Returns:
+            list with the retrieved documents of each query
+        """
+        from rag.rerank_service import rerank_batch, ranked_documents
+
+        if not queries:
+            return []
+
+        query_matrix = self._normalize(np.asarray(self.embeddings.embed_documents(queries), dtype=np.float32))
+
+        vector_docs = self._vector_search(query_matrix)
+        bm25_docs = self._bm25_search(queries)
+
+        requests = []
+        for query, chroma_list, bm25_list in zip(queries, vector_docs, bm25_docs):
+            fused = self.ensemble.weighted_reciprocal_rank([chroma_list, bm25_list])
+            filtered = self._filter_redundant(fused)
+            passages = [{'id': i, 'text': doc.page_content, 'meta': doc.metadata} for i, doc in enumerate(filtered)]
+            requests.append((query, passages))
+
+        ranked = rerank_batch(self.ranker, requests)
+
+        return [ranked_documents(passages, self.top_n) for passages in ranked]
+
+    def stream(self, queries: Iterable[str], batch_size: int = 64) -> Iterator[List[Document]]:
+        """
+        Retrieve documents for an iterable of queries, holding one batch in memory.
+
+        Args:
+            queries: iterable of strings, user's questions
+            batch_size: int, queries embedded and searched together
+
+        Returns:
+            iterator with the retrieved documents of each query, in order
+        """
+        queries = iter(queries)
+        while True:
+            batch = list(islice(queries, batch_size))
+            if not batch:
+                break
+            yield from self.invoke_batch(batch)
+
+    def _vector_search(self, query_matrix: np.ndarray) -> List[List[Document]]:
+        """
+        MMR search of every query at once, equivalent to Chroma's `mmr` search type.
+
+        Args:
+            query_matrix: np.ndarray, normalized query embeddings (batch x dim)
+
+        Returns:
+            list with the selected documents of each query
+        """
+        similarity = query_matrix @ self.matrix.T
+        fetch_k = min(self.fetch_k, similarity.shape[1])
+        k = min(self.k, fetch_k)
+        if k <= 0:
+            return [[] for _ in range(len(query_matrix))]
+
+        # Top fetch_k candidates of each query, most similar first
+        candidates = np.argpartition(-similarity, fetch_k - 1, axis=1)[:, :fetch_k]
+        order = np.argsort(-np.take_along_axis(similarity, candidates, axis=1), axis=1, kind='stable')
+        candidates = np.take_along_axis(candidates, order, axis=1)
+        similarity_to_query = np.take_along_axis(similarity, candidates, axis=1)
+
+        # Greedy MMR, one step for all the queries at a time
+        candidate_embeddings = self.matrix[candidates]
+        pairwise = candidate_embeddings @ candidate_embeddings.transpose(0, 2, 1)
+        rows = np.arange(len(candidates))
+
+        selected = [np.argmax(similarity_to_query, axis=1)]
+        chosen = np.zeros(similarity_to_query.shape, dtype=bool)
+        chosen[rows, selected[0]] = True
+        similarity_to_selected = pairwise[rows, selected[0]]
+
+        for _ in range(1, k):
+            score = self.lambda_mult * similarity_to_query - (1 - self.lambda_mult) * similarity_to_selected
+            score[chosen] = -np.inf
+            best = np.argmax(score, axis=1)
+            selected.append(best)
+            chosen[rows, best] = True
+            similarity_to_selected = np.maximum(similarity_to_selected, pairwise[rows, best])
+
+        selected = np.take_along_axis(candidates, np.stack(selected, axis=1), axis=1)
+
+        return [[self.documents[i] for i in row] for row in selected]
+
+    def _bm25_search(self, queries: List[str]) -> List[List[Document]]:
+        """
+        BM25 scores of every query from the inverted index, equivalent to BM25Retriever.
+
+        Args:
+            queries: list of strings, user's questions
+
+        Returns:
+            list with the top BM25 documents of each query
+        """
+        idf = self.bm25.vectorizer.idf
+
+        results = []
+        for query in queries:
+            # Only the postings of the query terms are touched, memory is one score per document
+            scores = np.zeros(len(self.bm25.docs))
+            for token in self.bm25.preprocess_func(query):
+                if token in self.postings:
+                    doc_ids, term_weights = self.postings[token]
+                    np.add.at(scores, doc_ids, (idf.get(token) or 0) * term_weights)
+
+            top = np.argsort(scores)[::-1][:self.bm25.k]
+            results.append([self.bm25.docs[j] for j in top])
+
+        return results
+
+    def _filter_redundant(self, documents: List[Document]) -> List[Document]:
+        """
+        Drop highly similar documents, equivalent to EmbeddingsRedundantFilter.
+
+        Args:
+            documents: list of fused documents
+
+        Returns:
+            list of documents without redundancy
+        """
+        if len(documents) < 2:
+            return documents
+
+        missing = [doc.page_content for doc in documents if doc.page_content not in self.index_by_content]
+        extra = iter(self._normalize(np.asarray(self.embeddings.embed_documents(missing), dtype=np.float32))) if missing else None
+
+        embedded = np.stack([
+            self.matrix[self.index_by_content[doc.page_content]] if doc.page_content in self.index_by_content else next(extra)
+            for doc in documents
+        ])
+
+        similarity = np.tril(embedded @ embedded.T, k=-1)
+        redundant = np.column_stack(np.where(similarity > self.redundant_threshold))
+        redundant = redundant[np.argsort(similarity[redundant[:, 0], redundant[:, 1]])[::-1]]
+
+        included = set(range(len(documents)))
+        for first, second in redundant:
+            # Drop the second document of any highly similar pair
+            if first in included and second in included:
+                included.remove(second)
+
+        return [documents[i] for i in sorted(included)]
+
+    @staticmethod
+    def _bm25_postings(vectorizer: Any) -> Dict[str, tuple]:
+        """
+        Inverted index with the BM25 term weight of every document.
+
+        Args:
+            vectorizer: BM25Okapi, fitted BM25 model of the retriever
+
+        Returns:
+            dict, term -> (document indexes, term weights)
+        """
+        postings = defaultdict(lambda: ([], []))
+        k1, b, avgdl = vectorizer.k1, vectorizer.b, vectorizer.avgdl
+
+        for i, (frequencies, doc_len) in enumerate(zip(vectorizer.doc_freqs, vectorizer.doc_len)):
+            norm = k1 * (1 - b + b * doc_len / avgdl)
+            for term, freq in frequencies.items():
+                postings[term][0].append(i)
+                postings[term][1].append(freq * (k1 + 1) / (freq + norm))
+
+        return {term: (np.array(ids), np.array(values)) for term, (ids, values) in postings.items()}
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        """
+        L2 normalize the rows of a matrix, so dot products are cosine similarities.
+
+        Args:
+            matrix: np.ndarray, embeddings (rows x dim)
+
+        Returns:
+            np.ndarray, normalized embeddings
+        """
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return matrix / norms
+
+
+def _json_default(value: Any) -> Any:
+    """
+    Make numpy scalars (e.g. relevance scores) JSON serializable.
+    """
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+def _read_queries(input_path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Read the records of a JSONL queries file.
+
+    Args:
+        input_path: str, JSONL file with one object with a `query` string per line
+
+    Returns:
+        iterator with the records, blank lines are skipped
+    """
+    with open(input_path, 'r', encoding='utf-8') as input_file:
+        for line_number, line in enumerate(input_file, 1):
+            if not line.strip():
+                continue
+
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as error:
+                raise ValueError(f"{input_path}:{line_number}: invalid JSON ({error.msg})") from error
+
+            if not isinstance(record, dict) or not isinstance(record.get('query'), str):
+                raise ValueError(f"{input_path}:{line_number}: expected an object with a 'query' string")
+
+            yield record
+
+
+def retrieve_jsonl(collection_name: str, input_path: str, output_path: str, batch_size: int = 64) -> int:
+    """
+    Retrieve documents for the queries of a JSONL file, streaming results to another JSONL.
+
+    Each input line is an object with a `query` key (other keys are kept). Each output
+    line is the same object with a `documents` key added. The input is validated before
+    any retrieval, so a malformed line fails fast instead of leaving a truncated output.
+
+    Args:
+        collection_name: str, collection to be used
+        input_path: str, JSONL file with the queries
+        output_path: str, JSONL file to write the results
+        batch_size: int, queries processed together
+
+    Returns:
+        int, number of processed queries
+    """
+    # Validation pass, keeps nothing in memory
+    for _ in _read_queries(input_path):
+        pass
+
+    retriever = BatchRetriever(collection_name)
+    total = 0
+
+    # `stream` reads one batch ahead, so tee buffers at most `batch_size` records
+    records, for_queries = tee(_read_queries(input_path))
+    queries = (record['query'] for record in for_queries)
+
+    with open(output_path, 'w', encoding='utf-8') as output_file:
+        for record, documents in zip(records, retriever.stream(queries, batch_size)):
+            record['documents'] = [
+                {'page_content': doc.page_content, 'metadata': doc.metadata} for doc in documents
+            ]
+            output_file.write(json.dumps(record, ensure_ascii=False, default=_json_default) + '\n')
+
+            total += 1
+            if total % batch_size == 0:
+                output_file.flush()
+
+    return total
+
+
 if __name__ == '__main__':
-    # Example usage
-    retriever = ensemble_retriever('design')
-    
-    # Test query
-    query = '¿qué es un sistema complejo?'
-    print(f"Query: {query}\n")
-    
-    response = retriever.invoke(query)
-    print(f"Retrieved {len(response)} documents:\n")
-    
-    for i, doc in enumerate(response, 1):
-        print(f"Document {i}:")
-        print(doc.page_content[:200] + "...\n")
+    parser = argparse.ArgumentParser(description='Retrieve documents from ChromaDB and BM25 with reranking.')
+    parser.add_argument('--collection', default='design', help='collection to be used')
+    parser.add_argument('--query', default='¿qué es un sistema complejo?', help='single query to test')
+    parser.add_argument('--input', help='JSONL file with one {"query": ...} per line for batch retrieval')
+    parser.add_argument('--output', default='data/retrieval.jsonl', help='JSONL file for the batch results')
+    parser.add_argument('--batch-size', type=int, default=64, help='queries processed together')
+    args = parser.parse_args()
+
+    if args.input:
+        total = retrieve_jsonl(args.collection, args.input, args.output, args.batch_size)
+        print(f"Retrieved documents for {total} queries into {args.output}")
+
+    else:
+        # Example usage
+        retriever = ensemble_retriever(args.collection)
+
+        # Test query
+        query = args.query
+        print(f"Query: {query}\n")
+
+        response = retriever.invoke(query)
+        print(f"Retrieved {len(response)} documents:\n")
+
+        for i, doc in enumerate(response, 1):
+            print(f"Document {i}:")
+            print(doc.page_content[:200] + "...\n")
@@ -0,0 +1,173 @@
+"""
+Semantic response cache for near-duplicate questions.
+
+Answers are stored with the embedding of their question, the collection and
+the index version they were generated from. A new question whose embedding is
+similar enough to a stored one, for the same collection and index version,
+gets the stored answer back without retrieval nor LLM call.
+
+Only standalone questions should go through the cache: the answer to a
+follow-up question depends on the conversation history, so callers bypass
+the cache when the history is not empty.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import TYPE_CHECKING, List, Optional
+import hashlib
+import os
+import re
+import threading
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from langchain_openai import OpenAIEmbeddings
+
+
+def index_version(collection_name: str, data_dir: str = 'data') -> str:
+    """
+    Version of the index of a collection, changes every time create_vectordb.py rebuilds it.
+
+    Args:
+        collection_name: str, collection to be used
+        data_dir: str, folder with Chroma and BM25 files
+
+    Returns:
+        str, short hash of the index files modification time and size
+    """
+    digest = hashlib.sha1(collection_name.encode())
+
+    for path in [f'{data_dir}/{collection_name}_bm25', f'{data_dir}/chroma_db/chroma.sqlite3']:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            digest.update(f'{path}:{stat.st_mtime_ns}:{stat.st_size}'.encode())
+
+    return digest.hexdigest()[:12]
+
+
+class SemanticCache:
+    """
+    In-memory LRU cache of answers looked up by question similarity.
+    """
+
+    def __init__(self,
+                 embeddings: Optional[OpenAIEmbeddings] = None,
+                 threshold: float = 0.95,
+                 capacity: int = 1000):
+        """
+        Initialize an empty cache.
+
+        Args:
+            embeddings: OpenAIEmbeddings, model to embed the questions (new one if None)
+            threshold: float, minimum cosine similarity to reuse an answer
+            capacity: int, maximum number of stored answers, least recently used are evicted
+        """
+        if embeddings is None:
+            from langchain_openai import OpenAIEmbeddings
+            embeddings = OpenAIEmbeddings()
+
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.capacity = capacity
+
+        self._matrix = None
+        self._namespaces = np.empty(capacity, dtype=object)
+        self._answers = [None] * capacity
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed(self, question: str) -> np.ndarray:
+        """
+        Embed a question for `get` and `put`.
+
+        Args:
+            question: str, user's question
+
+        Returns:
+            np.ndarray, normalized embedding of the question
+        """
+        embedding = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm else embedding
+
+    def get(self, embedding: np.ndarray, collection_name: str, version: str) -> Optional[str]:
+        """
+        Look up the answer of the most similar stored question.
+
+        Args:
+            embedding: np.ndarray, normalized embedding of the question
+            collection_name: str, collection used to answer
+            version: str, index version used to answer
+
+        Returns:
+            str, stored answer, or None if no question is similar enough
+        """
+        namespace = f'{collection_name}:{version}'
+
+        with self._lock:
+            if not self._lru:
+                return None
+
+            slots = np.fromiter(self._lru.keys(), dtype=np.int64)
+            slots = slots[self._namespaces[slots] == namespace]
+            if not len(slots):
+                return None
+
+            similarity = self._matrix[slots] @ embedding
+            best = int(np.argmax(similarity))
+            if similarity[best] < self.threshold:
+                return None
+
+            slot = int(slots[best])
+            self._lru.move_to_end(slot)
+
+            return self._answers[slot]
+
+    def put(self, embedding: np.ndarray, answer: str, collection_name: str, version: str) -> None:
+        """
+        Store an answer, evicting the least recently used one if the cache is full.
+
+        Args:
+            embedding: np.ndarray, normalized embedding of the question
+            answer: str, generated answer
+            collection_name: str, collection used to answer
+            version: str, index version used to answer
+
+        Returns:
+            None
+        """
+        # An empty answer would be streamed back as an empty response on every hit
+        if self.capacity <= 0 or not answer:
+            return
+
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((self.capacity, len(embedding)), dtype=np.float32)
+
+            if len(self._lru) < self.capacity:
+                slot = len(self._lru)
+            else:
+                slot, _ = self._lru.popitem(last=False)
+
+            self._matrix[slot] = embedding
+            self._namespaces[slot] = f'{collection_name}:{version}'
+            self._answers[slot] = answer
+            self._lru[slot] = None
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+
+def stream_answer(answer: str) -> List[str]:
+    """
+    Split a stored answer in word chunks, to stream it like an LLM response.
+
+    Args:
+        answer: str, stored answer
+
+    Returns:
+        list of strings, chunks of the answer
+    """
+    return re.findall(r'\S+\s*|\s+', answer)
@@ -0,0 +1,122 @@
+"""
+Batch retrieval against the LangChain retrievers it replaces, and JSONL validation.
+
+BatchRetriever is built without its index files (no Chroma nor OpenAI), from
+a random normalized matrix and BM25Retriever.from_texts, so the tests run offline.
+"""
+
+from pathlib import Path
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = Path(__file__).parent.parent
+sys.path.append(str(ROOT))
+
+from rag.retrieve_db import BatchRetriever, retrieve_jsonl
+
+WORDS = ['logo', 'color', 'font', 'grid', 'poster', 'brand', 'layout', 'contrast', 'icon', 'space']
+
+
+def _retriever(matrix: np.ndarray, texts: list, **kwargs) -> BatchRetriever:
+    """
+    BatchRetriever over the given embeddings and texts, skipping __init__.
+    """
+    from langchain_community.retrievers import BM25Retriever
+
+    retriever = object.__new__(BatchRetriever)
+    retriever.k = kwargs.get('k', 4)
+    retriever.fetch_k = kwargs.get('fetch_k', 10)
+    retriever.lambda_mult = kwargs.get('lambda_mult', 0.5)
+    retriever.redundant_threshold = kwargs.get('redundant_threshold', 0.95)
+
+    retriever.bm25 = BM25Retriever.from_texts(texts, k=kwargs.get('bm25_k', 4))
+    retriever.postings = BatchRetriever._bm25_postings(retriever.bm25.vectorizer)
+    retriever.documents = retriever.bm25.docs
+    retriever.matrix = BatchRetriever._normalize(matrix.astype(np.float32))
+    retriever.index_by_content = {doc.page_content: i for i, doc in enumerate(retriever.documents)}
+
+    return retriever
+
+
+@pytest.fixture
+def corpus():
+    pytest.importorskip('langchain_community')
+    pytest.importorskip('rank_bm25')
+
+    rng = np.random.default_rng(0)
+    texts = [' '.join(rng.choice(WORDS, size=rng.integers(3, 12))) + f' doc{i}' for i in range(60)]
+    matrix = rng.normal(size=(len(texts), 16))
+
+    return rng, matrix, texts
+
+
+def test_bm25_search_matches_bm25_retriever(corpus):
+    rng, matrix, texts = corpus
+    retriever = _retriever(matrix, texts)
+    queries = [' '.join(rng.choice(WORDS, size=3)) for _ in range(20)] + ['unknown words only']
+
+    expected = [[doc.page_content for doc in retriever.bm25.invoke(query)] for query in queries]
+    results = [[doc.page_content for doc in docs] for docs in retriever._bm25_search(queries)]
+
+    assert results == expected
+
+
+def test_vector_search_matches_maximal_marginal_relevance(corpus):
+    from langchain_core.vectorstores.utils import maximal_marginal_relevance
+
+    rng, matrix, texts = corpus
+    retriever = _retriever(matrix, texts)
+    queries = BatchRetriever._normalize(rng.normal(size=(20, matrix.shape[1])).astype(np.float32))
+
+    results = retriever._vector_search(queries)
+
+    for query, docs in zip(queries, results):
+        # Chroma's mmr: top fetch_k by similarity, then MMR over those candidates
+        candidates = np.argsort(-(retriever.matrix @ query), kind='stable')[:retriever.fetch_k]
+        selected = maximal_marginal_relevance(query, retriever.matrix[candidates],
+                                              lambda_mult=retriever.lambda_mult, k=retriever.k)
+
+        assert [doc.page_content for doc in docs] == [texts[candidates[i]] for i in selected]
+
+
+def test_filter_redundant_matches_embeddings_redundant_filter(corpus):
+    from langchain_community.document_transformers.embeddings_redundant_filter import _filter_similar_embeddings
+    from langchain_community.utils.math import cosine_similarity
+
+    rng, matrix, texts = corpus
+    # Near duplicates of some documents, so there is something to drop
+    matrix[30:40] = matrix[:10] + rng.normal(scale=0.05, size=(10, matrix.shape[1]))
+    retriever = _retriever(matrix, texts)
+
+    for _ in range(20):
+        documents = [retriever.documents[i] for i in rng.permutation(40)[:12]]
+        embedded = matrix[[retriever.index_by_content[doc.page_content] for doc in documents]]
+
+        expected = [documents[i] for i in _filter_similar_embeddings(embedded, cosine_similarity,
+                                                                     retriever.redundant_threshold)]
+
+        assert retriever._filter_redundant(documents) == expected
+
+
+def test_retrieve_jsonl_rejects_bad_line_before_writing(tmp_path):
+    input_path = tmp_path / 'queries.jsonl'
+    output_path = tmp_path / 'results.jsonl'
+    input_path.write_text('{"query": "logo colors"}\n{"question": "fonts"}\n', encoding='utf-8')
+
+    with pytest.raises(ValueError, match=f"{input_path}:2: expected an object with a 'query' string"):
+        retrieve_jsonl('design', str(input_path), str(output_path))
+
+    assert not output_path.exists()
+
+
+def test_retrieve_jsonl_rejects_invalid_json(tmp_path):
+    input_path = tmp_path / 'queries.jsonl'
+    output_path = tmp_path / 'results.jsonl'
+    input_path.write_text('{"query": "logo colors"}\n\n{"query": \n', encoding='utf-8')
+
+    with pytest.raises(ValueError, match=f'{input_path}:3: invalid JSON'):
+        retrieve_jsonl('design', str(input_path), str(output_path))
+
+    assert not output_path.exists()
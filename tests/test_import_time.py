@@ -0,0 +1,74 @@
+"""
+Import-time budget for the rag and crag packages and the retrieve_db.py CLI.
+
+Runs each command in a fresh interpreter with `python -X importtime` and checks
+that no heavy dependency is loaded and that the imports stay under budget.
+"""
+
+from pathlib import Path
+import subprocess
+import sys
+
+ROOT = Path(__file__).parent.parent
+
+HEAVY_MODULES = ('langchain', 'chromadb', 'flashrank')
+
+# Cumulative import time budgets, in microseconds
+PACKAGES_BUDGET_US = 200_000
+CLI_HELP_BUDGET_US = 750_000
+
+
+def _importtime(*args: str) -> dict:
+    """
+    Run python -X importtime with the given arguments from the repo root.
+
+    Args:
+        args: str, arguments after `python -X importtime`
+
+    Returns:
+        dict, top-level module name -> cumulative import time (us), plus all
+        the imported module names under the `modules` key
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', *args],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+
+    cumulative = {}
+    modules = set()
+
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        _, cumulative_us, name = line.split('|')
+        modules.add(name.strip())
+
+        # Nested imports are indented under the module that imported them
+        if not name[1:].startswith(' '):
+            cumulative[name.strip()] = int(cumulative_us)
+
+    return {'cumulative': cumulative, 'modules': modules}
+
+
+def _heavy(modules: set) -> list:
+    return sorted(m for m in modules if m.split('.')[0].startswith(HEAVY_MODULES))
+
+
+def test_import_packages_is_lazy():
+    times = _importtime('-c', 'import rag, crag, crag.create_vectordb, crag.retrieve_db')
+
+    assert _heavy(times['modules']) == []
+
+    total = sum(times['cumulative'][name] for name in ['rag', 'crag', 'crag.create_vectordb', 'crag.retrieve_db'])
+    assert total < PACKAGES_BUDGET_US
+
+
+def test_retrieve_db_help_is_lazy():
+    times = _importtime('rag/retrieve_db.py', '--help')
+
+    assert _heavy(times['modules']) == []
+    assert sum(times['cumulative'].values()) < CLI_HELP_BUDGET_US
@@ -0,0 +1,149 @@
+"""
+Semantic cache lookups, eviction and the cache path of the chatbot.
+
+Questions are embedded with a bag-of-words stub, so the tests run offline.
+"""
+
+from pathlib import Path
+import re
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = Path(__file__).parent.parent
+sys.path.append(str(ROOT))
+
+from rag.semantic_cache import SemanticCache, stream_answer
+
+VOCABULARY = ['how', 'do', 'i', 'design', 'a', 'logo', 'poster', 'colors', 'choose', 'and', 'why']
+
+
+class StubEmbeddings:
+    """
+    Bag-of-words embeddings over a small vocabulary, counts the calls.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed_query(self, text: str) -> list:
+        self.calls += 1
+        words = re.findall(r'\w+', text.lower())
+        return [float(words.count(word)) for word in VOCABULARY]
+
+
+@pytest.fixture
+def cache():
+    return SemanticCache(embeddings=StubEmbeddings(), threshold=0.9, capacity=2)
+
+
+def test_hit_above_threshold_and_miss_below(cache):
+    cache.put(cache.embed('How do I design a logo?'), 'answer', 'design', 'v1')
+
+    assert cache.get(cache.embed('how do I design a logo'), 'design', 'v1') == 'answer'
+    assert cache.get(cache.embed('how do I design a poster'), 'design', 'v1') is None
+
+
+def test_isolated_by_collection_and_version(cache):
+    embedding = cache.embed('How do I design a logo?')
+    cache.put(embedding, 'answer', 'design', 'v1')
+
+    assert cache.get(embedding, 'other', 'v1') is None
+    assert cache.get(embedding, 'design', 'v2') is None
+    assert cache.get(embedding, 'design', 'v1') == 'answer'
+
+
+def test_evicts_least_recently_used(cache):
+    logo, poster, colors = (cache.embed(q) for q in ['design a logo', 'design a poster', 'choose colors'])
+
+    cache.put(logo, 'logo', 'design', 'v1')
+    cache.put(poster, 'poster', 'design', 'v1')
+
+    # The lookup makes the logo the most recently used, so the poster is evicted
+    assert cache.get(logo, 'design', 'v1') == 'logo'
+    cache.put(colors, 'colors', 'design', 'v1')
+
+    assert len(cache) == 2
+    assert cache.get(poster, 'design', 'v1') is None
+    assert cache.get(logo, 'design', 'v1') == 'logo'
+    assert cache.get(colors, 'design', 'v1') == 'colors'
+
+
+def test_put_ignores_empty_answers(cache):
+    cache.put(cache.embed('design a logo'), '', 'design', 'v1')
+
+    assert len(cache) == 0
+    assert cache.get(cache.embed('design a logo'), 'design', 'v1') is None
+
+
+def test_zero_capacity_stores_nothing():
+    cache = SemanticCache(embeddings=StubEmbeddings(), capacity=0)
+    cache.put(cache.embed('design a logo'), 'answer', 'design', 'v1')
+
+    assert len(cache) == 0
+    assert cache.get(cache.embed('design a logo'), 'design', 'v1') is None
+
+
+def test_stream_answer_keeps_the_text():
+    answer = 'Use  two colors,\nand a clear font. '
+
+    assert ''.join(stream_answer(answer)) == answer
+
+
+class FakeChain:
+    """
+    Streams a fixed answer, counts the calls.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def stream(self, inputs: dict):
+        self.calls += 1
+        yield from ['Use ', 'two ', 'colors.']
+
+
+class FakeRetriever:
+    def invoke(self, prompt: str) -> list:
+        return []
+
+
+@pytest.fixture
+def chat(monkeypatch):
+    pytest.importorskip('langchain_openai')
+    sys.path.insert(0, str(ROOT / 'app'))
+    from chatbot.chatbot import Chat
+
+    chat = Chat()
+    chat.cache = SemanticCache(embeddings=StubEmbeddings(), threshold=0.9)
+    chat._retriever = FakeRetriever()
+    chat.chain = FakeChain()
+    monkeypatch.setattr(chat, 'chain_to_response', lambda memory=None: chat.chain)
+
+    return chat
+
+
+def test_chat_serves_near_identical_question_from_cache(chat):
+    first = ''.join(chat.main('How do I design a logo?', memory=chat.new_memory()))
+
+    memory = chat.new_memory()
+    second = ''.join(chat.main('how do i design a logo', memory=memory))
+
+    assert first == second == 'Use two colors.'
+    assert chat.chain.calls == 1
+
+    # The cached turn is saved once in the session memory, like a generated one
+    history = memory.load_memory_variables({})['history']
+    assert [(m.type, m.content) for m in history] == [('human', 'how do i design a logo'),
+                                                      ('ai', 'Use two colors.')]
+
+
+def test_chat_follow_up_questions_bypass_cache(chat):
+    memory = chat.new_memory()
+    ''.join(chat.main('How do I design a logo?', memory=memory))
+    ''.join(chat.main('How do I design a logo?', memory=memory))
+
+    assert chat.chain.calls == 2
+    assert len(chat.cache) == 1
+    assert len(memory.load_memory_variables({})['history']) == 4